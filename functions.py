@@ -1,30 +1,78 @@
-import csv
+import copy
 import os
-import subprocess
+import sys
+import threading
+import orjson
 import requests
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+from cachetools import TTLCache, cached
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import monotonic, sleep
 from dotenv import load_dotenv
 
 load_dotenv()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Read once at import; _api_get still reports a missing key when it is called
+_API_KEY = os.getenv('METROLINX_API_KEY')
 
 BASE_URL = "https://api.openmetrolinx.com/OpenDataAPI/api/V1/"
 
-def findTrip(date="20250902", from_station="ML", to_station="UN", time="0700", max_results="20"):
-    api_key = os.getenv('METROLINX_API_KEY')
+# (connect, read) seconds to wait on the Metrolinx API before giving up on a request
+REQUEST_TIMEOUT = (3, 10)
+
+# Retry transient upstream failures (dropped connections, rate limiting, gateway errors)
+# with a short exponential backoff before surfacing them to the caller
+RETRY_POLICY = Retry(
+    total=3,
+    connect=2,
+    read=2,
+    backoff_factor=0.3,
+    status_forcelist=(429, 502, 503, 504),
+    allowed_methods=frozenset(['GET']),
+)
+
+# Shared session so repeated API calls reuse the same keep-alive connection.
+# The pool is sized for the concurrent schedule + real-time fetches.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=RETRY_POLICY))
+
+# The feeds are large, repetitive JSON - ask for them compressed. urllib3's
+# ACCEPT_ENCODING adds "br" when brotli is installed and decodes it transparently.
+SESSION.headers.update({
+    "Accept": "application/json",
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "User-Agent": "go-transit-mcp/0.1.0",
+})
+
+def _api_get(endpoint, gtfs=False):
+    """
+    Fetch a Metrolinx Open Data API endpoint and return the decoded JSON.
     
-    if not api_key:
+    Regular endpoints are checked for a '200' Metadata.ErrorCode; GTFS feeds
+    (gtfs=True) have no Metadata block and are checked for header/entity instead.
+    """
+    if not _API_KEY:
         raise ValueError("METROLINX_API_KEY not found in environment variables")
     
-    endpoint = f"Schedule/Journey/{date}/{from_station}/{to_station}/{time}/{max_results}"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
+    url = f"{BASE_URL}{endpoint}?key={_API_KEY}"
     
     try:
-        response = requests.get(url)
+        response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         
-        data = response.json()
+        data = orjson.loads(response.content)
+        
+        if gtfs:
+            # GTFS feeds have a different structure - check for header and entity
+            if 'header' in data and 'entity' in data:
+                return data
+            else:
+                raise Exception("Invalid GTFS response format")
         
         if data.get('Metadata', {}).get('ErrorCode') == '200':
             return data
@@ -32,6 +80,15 @@ def findTrip(date="20250902", from_station="ML", to_station="UN", time="0700", m
             error_msg = data.get('Metadata', {}).get('ErrorMessage', 'Unknown error')
             raise Exception(f"API Error: {error_msg}")
             
+    except requests.exceptions.Timeout as e:
+        # Upstream is slow rather than broken - worth retrying later
+        raise Exception(f"Request timed out: {str(e)}")
+    except requests.exceptions.ConnectionError as e:
+        # Read timeouts that used up RETRY_POLICY's retries arrive as a MaxRetryError wrapping ReadTimeoutError
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        if isinstance(reason, ReadTimeoutError):
+            raise Exception(f"Request timed out: {str(e)}")
+        raise Exception(f"Request failed: {str(e)}")
     except requests.exceptions.RequestException as e:
         raise Exception(f"Request failed: {str(e)}")
     except ValueError as e:
@@ -40,240 +97,278 @@ def findTrip(date="20250902", from_station="ML", to_station="UN", time="0700", m
         raise Exception(f"Unexpected error: {str(e)}")
 
 
+def _withoutMetadata(data):
+    """
+    Drop the API's Metadata envelope once _api_get has checked it; callers never read it.
+    """
+    return {key: value for key, value in data.items() if key != 'Metadata'}
+
+
+# Identical journey queries within a minute get the same schedule back
+@cached(TTLCache(maxsize=1024, ttl=60), lock=threading.Lock())
+def findTrip(date="20250902", from_station="ML", to_station="UN", time="0700", max_results="20"):
+    return _withoutMetadata(_api_get(f"Schedule/Journey/{date}/{from_station}/{to_station}/{time}/{max_results}"))
+
+
+# The station catalog is effectively static, so keep it for a day
+@cached(TTLCache(maxsize=1, ttl=86400), lock=threading.Lock())
 def getStations():
-    api_key = os.getenv('METROLINX_API_KEY')
+    data = _api_get("Stop/All")
     
-    if not api_key:
-        raise ValueError("METROLINX_API_KEY not found in environment variables")
+    # Transform the JSON response into comma-separated string format
+    stations = data.get('Stations', {}).get('Station', [])
     
-    endpoint = "Stop/All"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
+    # Build comma-separated string with station names and codes
+    station_list = []
+    for station in stations:
+        location_name = station.get('LocationName', '')
+        location_code = station.get('LocationCode', '')
+        if location_name and location_code:
+            station_list.append(f"{location_name} - {location_code}")
     
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data.get('Metadata', {}).get('ErrorCode') == '200':
-            # Transform the JSON response into comma-separated string format
-            stations = data.get('Stations', {}).get('Station', [])
-            
-            # Build comma-separated string with station names and codes
-            station_list = []
-            for station in stations:
-                location_name = station.get('LocationName', '')
-                location_code = station.get('LocationCode', '')
-                if location_name and location_code:
-                    station_list.append(f"{location_name} - {location_code}")
-            
-            # Join all stations with commas
-            return ", ".join(station_list)
-        else:
-            error_msg = data.get('Metadata', {}).get('ErrorMessage', 'Unknown error')
-            raise Exception(f"API Error: {error_msg}")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Request failed: {str(e)}")
-    except ValueError as e:
-        raise Exception(f"Invalid JSON response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Unexpected error: {str(e)}")
+    # Join all stations with commas
+    return ", ".join(station_list)
 
 
+# Fares only change with tariff releases. ~70 stations gives at most ~5000 pairs,
+# so keep every pair for six hours; getFare.cache_clear() flushes them early.
+@cached(TTLCache(maxsize=4096, ttl=6 * 3600), lock=threading.Lock())
 def getFare(from_station, to_station):
-    api_key = os.getenv('METROLINX_API_KEY')
+    # A fare needs both ends; don't spend a round trip on a request that can only fail
+    if not from_station or not to_station:
+        raise ValueError("Both from_station and to_station are required to look up a fare")
     
-    if not api_key:
-        raise ValueError("METROLINX_API_KEY not found in environment variables")
-    
-    endpoint = f"Fares/{from_station}/{to_station}"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data.get('Metadata', {}).get('ErrorCode') == '200':
-            return data
-        else:
-            error_msg = data.get('Metadata', {}).get('ErrorMessage', 'Unknown error')
-            raise Exception(f"API Error: {error_msg}")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Request failed: {str(e)}")
-    except ValueError as e:
-        raise Exception(f"Invalid JSON response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Unexpected error: {str(e)}")
+    return _withoutMetadata(_api_get(f"Fares/{from_station}/{to_station}"))
 
 
 def getTripUpdates():
-    api_key = os.getenv('METROLINX_API_KEY')
-    
-    if not api_key:
-        raise ValueError("METROLINX_API_KEY not found in environment variables")
-    
-    endpoint = "Gtfs/Feed/TripUpdates"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # GTFS feeds have a different structure - check for header and entity
-        if 'header' in data and 'entity' in data:
-            return data
-        else:
-            raise Exception("Invalid GTFS response format")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Request failed: {str(e)}")
-    except ValueError as e:
-        raise Exception(f"Invalid JSON response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Unexpected error: {str(e)}")
+    return _api_get("Gtfs/Feed/TripUpdates", gtfs=True)
 
 def getServiceExceptions():
-    api_key = os.getenv('METROLINX_API_KEY')
-    
-    if not api_key:
-        raise ValueError("METROLINX_API_KEY not found in environment variables")
-    
-    endpoint = "ServiceUpdate/Exceptions/All"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data.get('Metadata', {}).get('ErrorCode') == '200':
-            return data
-        else:
-            error_msg = data.get('Metadata', {}).get('ErrorMessage', 'Unknown error')
-            raise Exception(f"API Error: {error_msg}")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Request failed: {str(e)}")
-    except ValueError as e:
-        raise Exception(f"Invalid JSON response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Unexpected error: {str(e)}")
+    return _api_get("ServiceUpdate/Exceptions/All")
 
 def getServiceAlerts():
-    api_key = os.getenv('METROLINX_API_KEY')
+    return _api_get("Gtfs/Feed/Alerts", gtfs=True)
+
+
+# Metrolinx refreshes the real-time feeds about every 30 seconds; poll a bit faster
+FEED_REFRESH_INTERVAL = 20
+
+# Stop polling after this many seconds without a findTripWithRealTime call
+FEED_IDLE_TIMEOUT = 300
+
+# A snapshot older than this is no longer "real-time"; trips are served without it instead
+FEED_MAX_AGE = 2 * FEED_REFRESH_INTERVAL
+
+# What getRealTimeSnapshot returns when there is no snapshot fresh enough to use
+_EMPTY_FEED_SNAPSHOT = {'trip_updates': None, 'exceptions': None, 'alerts': None, 'lookups': None, 'fetched_at': None}
+
+# Latest copy of the three real-time feeds, swapped wholesale by the refresher.
+# A feed is None when its last fetch failed.
+_feed_snapshot = _EMPTY_FEED_SNAPSHOT
+_feed_snapshot_ready = threading.Event()
+_feed_refresher = None
+_feed_refresher_lock = threading.Lock()
+_feed_last_used = 0.0
+
+def _refreshFeeds(executor):
+    """
+    Fetch all three real-time feeds concurrently and publish them as one snapshot.
+    """
+    global _feed_snapshot
     
-    if not api_key:
-        raise ValueError("METROLINX_API_KEY not found in environment variables")
+    futures = {
+        'trip_updates': executor.submit(getTripUpdates),
+        'exceptions': executor.submit(getServiceExceptions),
+        'alerts': executor.submit(getServiceAlerts),
+    }
     
-    endpoint = "Gtfs/Feed/Alerts"
-    url = f"{BASE_URL}{endpoint}?key={api_key}"
+    snapshot = {'fetched_at': datetime.now()}
+    for name, future in futures.items():
+        try:
+            snapshot[name] = future.result()
+        except Exception as e:
+            # Log error but keep serving scheduled trips without this feed
+            snapshot[name] = None
+    
+    # Index once per refresh instead of once per trip request
+    snapshot['lookups'] = buildRealTimeLookups(snapshot['trip_updates'], snapshot['exceptions'], snapshot['alerts'])
+    
+    _feed_snapshot = snapshot
+    _feed_snapshot_ready.set()
+
+def _feedRefreshLoop():
+    global _feed_refresher, _feed_snapshot
     
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # GTFS feeds have a different structure - check for header and entity
-        if 'header' in data and 'entity' in data:
-            return data
-        else:
-            raise Exception("Invalid GTFS response format")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Request failed: {str(e)}")
-    except ValueError as e:
-        raise Exception(f"Invalid JSON response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Unexpected error: {str(e)}")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            while True:
+                try:
+                    _refreshFeeds(executor)
+                except Exception as e:
+                    # A malformed feed shouldn't end real-time updates; the next round tries again
+                    pass
+                sleep(FEED_REFRESH_INTERVAL)
+                
+                # Don't keep spending API calls when nobody is asking for trips
+                with _feed_refresher_lock:
+                    if monotonic() - _feed_last_used > FEED_IDLE_TIMEOUT:
+                        _feed_refresher = None
+                        # Nothing from before the idle period may pass for current after a restart
+                        _feed_snapshot = _EMPTY_FEED_SNAPSHOT
+                        _feed_snapshot_ready.clear()
+                        return
+    finally:
+        # If the thread dies some other way, let the next request start a new one
+        with _feed_refresher_lock:
+            if _feed_refresher is threading.current_thread():
+                _feed_refresher = None
 
-def mergeRealTimeData(scheduled_trips, trip_updates=None, exceptions=None, alerts=None):
+def _ensureFeedRefresher():
+    global _feed_refresher, _feed_last_used
+    
+    with _feed_refresher_lock:
+        _feed_last_used = monotonic()
+        if _feed_refresher is None:
+            _feed_refresher = threading.Thread(target=_feedRefreshLoop, name="gtfs-feed-refresher", daemon=True)
+            _feed_refresher.start()
+
+def getRealTimeSnapshot(timeout=sum(REQUEST_TIMEOUT)):
     """
-    Merge real-time data with scheduled trips to provide enhanced status information.
+    Return the latest real-time feed snapshot, starting the background refresher on first use.
+    A snapshot older than FEED_MAX_AGE (the refresher is stuck or failing) comes back empty.
+    """
+    _ensureFeedRefresher()
+    _feed_snapshot_ready.wait(timeout)
+    snapshot = _feed_snapshot
+    fetched_at = snapshot['fetched_at']
+    if fetched_at is None or (datetime.now() - fetched_at).total_seconds() > FEED_MAX_AGE:
+        return _EMPTY_FEED_SNAPSHOT
+    return snapshot
+
+# Status attached to a trip before any real-time data is applied
+_DEFAULT_STATUS = {
+    'isDelayed': False,
+    'isCancelled': False,
+    'delayMinutes': 0,
+    'realTimeDeparture': None,
+    'realTimeArrival': None,
+    'statusMessage': None,
+}
+
+# Status shared by every trip with no real-time match - the common case.
+# It is handed out by reference, so never mutate it.
+_NO_STATUS = {**_DEFAULT_STATUS, 'alerts': []}
+
+def _tripKey(trip_id):
+    """
+    Split a GTFS tripId of the form "{Line}_{Number}" into an interned (line, number) key.
+    Returns None for ids that can never match a scheduled trip.
+    """
+    if not isinstance(trip_id, str):
+        return None
+    line, sep, number = trip_id.rpartition('_')
+    if not sep:
+        return None
+    return (sys.intern(line), sys.intern(number))
+
+def buildRealTimeLookups(trip_updates=None, exceptions=None, alerts=None):
+    """
+    Index the real-time feeds by trip so one snapshot can be merged into many schedules.
     """
-    if not scheduled_trips or 'SchJourneys' not in scheduled_trips:
-        return scheduled_trips
-    
     # Create lookup dictionaries for real-time data
     trip_updates_lookup = {}
     exceptions_lookup = {}
-    alerts_lookup = {}
+    alerts_lookup = defaultdict(list)
     
     # Process trip updates if available
-    if trip_updates and 'entity' in trip_updates:
-        for entity in trip_updates['entity']:
-            if 'tripUpdate' in entity and 'trip' in entity['tripUpdate']:
-                trip_id = entity['tripUpdate']['trip'].get('tripId', '')
-                trip_updates_lookup[trip_id] = entity['tripUpdate']
+    if trip_updates:
+        for entity in trip_updates.get('entity', ()):
+            update = entity.get('tripUpdate')
+            if update and 'trip' in update:
+                key = _tripKey(update['trip'].get('tripId', ''))
+                if key:
+                    trip_updates_lookup[key] = update
     
     # Process exceptions if available
-    if exceptions and 'Exceptions' in exceptions:
-        for exception in exceptions['Exceptions']:
-            trip_number = exception.get('TripNumber', '')
-            exceptions_lookup[trip_number] = exception
+    if exceptions:
+        exceptions_lookup = {
+            exception.get('TripNumber', ''): exception
+            for exception in exceptions.get('Exceptions', ())
+        }
     
     # Process alerts if available
-    if alerts and 'entity' in alerts:
-        for entity in alerts['entity']:
-            if 'alert' in entity:
-                alert = entity['alert']
-                # Alerts might affect multiple trips
-                if 'informedEntity' in alert:
-                    for informed_entity in alert['informedEntity']:
-                        if 'trip' in informed_entity:
-                            trip_id = informed_entity['trip'].get('tripId', '')
-                            if trip_id not in alerts_lookup:
-                                alerts_lookup[trip_id] = []
-                            alerts_lookup[trip_id].append(alert)
+    if alerts:
+        for entity in alerts.get('entity', ()):
+            alert = entity.get('alert')
+            if not alert:
+                continue
+            # Alerts might affect multiple trips
+            for informed_entity in alert.get('informedEntity', ()):
+                if 'trip' in informed_entity:
+                    key = _tripKey(informed_entity['trip'].get('tripId', ''))
+                    if key:
+                        alerts_lookup[key].append(alert)
+    
+    return trip_updates_lookup, exceptions_lookup, alerts_lookup
+
+def mergeRealTimeData(scheduled_trips, trip_updates=None, exceptions=None, alerts=None, lookups=None):
+    """
+    Merge real-time data with scheduled trips to provide enhanced status information.
+    Pass lookups from buildRealTimeLookups() to skip re-indexing the feeds.
+    """
+    if not scheduled_trips or 'SchJourneys' not in scheduled_trips:
+        return scheduled_trips
+    
+    if lookups is None:
+        # Nothing to merge when every real-time fetch failed or came back empty
+        if not (trip_updates or exceptions or alerts):
+            return scheduled_trips
+        lookups = buildRealTimeLookups(trip_updates, exceptions, alerts)
+    trip_updates_lookup, exceptions_lookup, alerts_lookup = lookups
     
     # Enhance each journey with real-time data
     for journey in scheduled_trips['SchJourneys']:
         for service in journey['Services']:
             for trip in service['Trips']['Trip']:
-                trip_number = trip.get('Number', '')
-                trip_id = f"{trip.get('Line', '')}_{trip_number}"
+                get = trip.get
+                trip_number = get('Number', '')
+                trip_id = (get('Line', ''), trip_number)
+                
+                # Most trips have no real-time data; skip building a status for them
+                if (trip_number not in exceptions_lookup
+                        and trip_id not in trip_updates_lookup
+                        and trip_id not in alerts_lookup):
+                    trip['Status'] = _NO_STATUS
+                    continue
                 
                 # Initialize status
-                trip['Status'] = {
-                    'isDelayed': False,
-                    'isCancelled': False,
-                    'delayMinutes': 0,
-                    'realTimeDeparture': None,
-                    'realTimeArrival': None,
-                    'statusMessage': None,
-                    'alerts': []
-                }
+                status = {**_DEFAULT_STATUS, 'alerts': []}
+                trip['Status'] = status
                 
                 # Check for exceptions (cancellations)
-                if trip_number in exceptions_lookup:
-                    exception = exceptions_lookup[trip_number]
-                    trip['Status']['isCancelled'] = True
-                    trip['Status']['statusMessage'] = exception.get('Message', 'Trip cancelled')
+                exception = exceptions_lookup.get(trip_number)
+                if exception is not None:
+                    status['isCancelled'] = True
+                    status['statusMessage'] = exception.get('Message', 'Trip cancelled')
                 
                 # Check for trip updates (delays)
                 elif trip_id in trip_updates_lookup:
-                    update = trip_updates_lookup[trip_id]
-                    if 'stopTimeUpdate' in update:
-                        for stop_update in update['stopTimeUpdate']:
-                            if 'departure' in stop_update and 'delay' in stop_update['departure']:
-                                delay_seconds = stop_update['departure']['delay']
-                                if delay_seconds > 0:
-                                    trip['Status']['isDelayed'] = True
-                                    trip['Status']['delayMinutes'] = delay_seconds // 60
-                                    trip['Status']['statusMessage'] = f"Delayed by {trip['Status']['delayMinutes']} minutes"
+                    # The last stop with a positive departure delay wins, so walk backwards and stop there
+                    for stop_update in reversed(trip_updates_lookup[trip_id].get('stopTimeUpdate', ())):
+                        delay_seconds = stop_update.get('departure', {}).get('delay', 0)
+                        if delay_seconds > 0:
+                            status['isDelayed'] = True
+                            status['delayMinutes'] = delay_seconds // 60
+                            status['statusMessage'] = f"Delayed by {status['delayMinutes']} minutes"
+                            break
                 
                 # Check for alerts
-                if trip_id in alerts_lookup:
-                    trip['Status']['alerts'] = alerts_lookup[trip_id]
-                    if not trip['Status']['statusMessage']:
-                        trip['Status']['statusMessage'] = "Service alerts available"
+                trip_alerts = alerts_lookup.get(trip_id)
+                if trip_alerts:
+                    status['alerts'] = list(trip_alerts)
+                    if not status['statusMessage']:
+                        status['statusMessage'] = "Service alerts available"
     
     return scheduled_trips
 
@@ -281,37 +376,22 @@ def findTripWithRealTime(date="20250902", from_station="ML", to_station="UN", ti
     """
     Enhanced findTrip function that includes real-time status information.
     """
+    # Make sure the feeds are being fetched while the schedule request is in flight
+    _ensureFeedRefresher()
+    
     # Get scheduled trips
     scheduled_trips = findTrip(date, from_station, to_station, time, max_results)
     
     if not scheduled_trips:
         return None
     
-    # Get real-time data (with error handling)
-    trip_updates = None
-    exceptions = None
-    alerts = None
+    # Real-time data comes from the background snapshot, not three more requests
+    feeds = getRealTimeSnapshot()
     
-    try:
-        trip_updates = getTripUpdates()
-    except Exception as e:
-        # Log error but continue with scheduled trips
-        pass
-    
-    try:
-        exceptions = getServiceExceptions()
-    except Exception as e:
-        # Log error but continue with scheduled trips
-        pass
-    
-    try:
-        alerts = getServiceAlerts()
-    except Exception as e:
-        # Log error but continue with scheduled trips
-        pass
+    # findTrip results are cached and shared, so merge into a private copy
+    scheduled_trips = copy.deepcopy(scheduled_trips)
     
     # Merge real-time data with scheduled trips
-    enhanced_trips = mergeRealTimeData(scheduled_trips, trip_updates, exceptions, alerts)
+    enhanced_trips = mergeRealTimeData(scheduled_trips, feeds['trip_updates'], feeds['exceptions'], feeds['alerts'], lookups=feeds['lookups'])
     
     return enhanced_trips
-
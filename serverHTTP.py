@@ -1,9 +1,12 @@
+import asyncio
 from mcp.server.fastmcp import FastMCP
-from functions import findTrip, getStations, getFare, findTripWithRealTime
+from functions import getStations, getFare, findTripWithRealTime
 from pydantic import BaseModel, Field
-from typing import List
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
+
+# Eastern timezone (handles EST/EDT automatically), resolved once at import
+EASTERN_TZ = ZoneInfo('America/Toronto')
 
 mcp = FastMCP("Go Transit", host="0.0.0.0", port=8000)
 
@@ -19,7 +22,7 @@ class FareRequest(BaseModel):
     to_station: str = Field(description="Destination station code (e.g., 'ML' for Milton, 'UN' for Union Station)")
 
 @mcp.tool()
-def get_stations() -> str | None:
+async def get_stations() -> str | None:
     """
     Retrieves the complete list of all GO Transit stations, bus stops, and transit hubs.
     
@@ -31,12 +34,12 @@ def get_stations() -> str | None:
         Returns None if error occurs.
     """
     try:
-        return getStations()
+        return await asyncio.to_thread(getStations)
     except Exception as e:
         return None
 
 @mcp.tool()
-def find_trip(trip: Trip) -> dict | None:
+async def find_trip(trip: Trip) -> dict | None:
     """
     Gets the trip information for a given date and time between two GO Transit locations.
     This enhanced version includes real-time status information such as delays, cancellations, and service alerts.
@@ -82,7 +85,8 @@ def find_trip(trip: Trip) -> dict | None:
         Returns None if no trips found or error occurs.
     """
     try:
-        return findTripWithRealTime(
+        return await asyncio.to_thread(
+            findTripWithRealTime,
             date=trip.date,
             from_station=trip.from_station,
             to_station=trip.to_station,
@@ -93,7 +97,7 @@ def find_trip(trip: Trip) -> dict | None:
         return None
 
 @mcp.tool()
-def get_fare(fare_request: FareRequest) -> dict | None:
+async def get_fare(fare_request: FareRequest) -> dict | None:
     """
     Gets the fare information between two GO Transit locations.
     
@@ -128,7 +132,8 @@ def get_fare(fare_request: FareRequest) -> dict | None:
         Returns None if no fares found or error occurs.
     """
     try:
-        return getFare(
+        return await asyncio.to_thread(
+            getFare,
             from_station=fare_request.from_station,
             to_station=fare_request.to_station
         )
@@ -136,6 +141,48 @@ def get_fare(fare_request: FareRequest) -> dict | None:
         return None
 
 
+@mcp.tool()
+async def find_trip_with_fare(trip: Trip) -> dict | None:
+    """
+    Gets the trips between two GO Transit locations along with the fare, in one call.
+    
+    Use this instead of calling find_trip() and get_fare() separately when the user asks
+    both when and how much (e.g., "When is the next train to Milton and what does it cost?").
+    
+    Args:
+        - date: Date in YYYYMMDD format (e.g., '20250902' for September 2, 2025)
+        - from_station: Origin station code (e.g., 'ML' for Milton, 'UN' for Union Station)
+        - to_station: Destination station code (e.g., 'ML' for Milton, 'UN' for Union Station)
+        - time: Time in HHMM format (e.g., '0700' for 7:00 AM, '1430' for 2:30 PM)
+        - max_results: Maximum number of results to return
+
+    Returns:
+        dict | None: {"trips": <find_trip result>, "fare": <get_fare result>}. Either part is None if
+        that lookup failed. Returns None if both fail.
+    """
+    trips, fare = await asyncio.gather(
+        asyncio.to_thread(
+            findTripWithRealTime,
+            date=trip.date,
+            from_station=trip.from_station,
+            to_station=trip.to_station,
+            time=trip.time,
+            max_results=trip.max_results
+        ),
+        asyncio.to_thread(
+            getFare,
+            from_station=trip.from_station,
+            to_station=trip.to_station
+        ),
+        return_exceptions=True
+    )
+    trips = None if isinstance(trips, Exception) else trips
+    fare = None if isinstance(fare, Exception) else fare
+    if trips is None and fare is None:
+        return None
+    return {"trips": trips, "fare": fare}
+
+
 @mcp.tool()
 def get_current_datetime() -> dict:
     """
@@ -144,9 +191,7 @@ def get_current_datetime() -> dict:
     Returns:
         dict: Current datetime information including day of week, date, time, and timezone
     """
-    # Eastern timezone (handles EST/EDT automatically)
-    eastern = pytz.timezone('America/Toronto')
-    now = datetime.now(eastern)
+    now = datetime.now(EASTERN_TZ)
     
     return {
         "current_datetime": now.strftime("%A, %B %d, %Y at %I:%M %p %Z"),
@@ -8,19 +8,32 @@ and provides a chat interface with Claude through a web interface for transit qu
 
 import streamlit as st
 import asyncio
-import json
+import hashlib
+import orjson
 import os
+import re
 import sys
+import threading
 from fastmcp import Client
+from fastmcp.client.client import CallToolResult
 from fastmcp.client.transports import StreamableHttpTransport
+from mcp.types import TextContent
 import anthropic
+import httpx
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-import pytz
+from functools import lru_cache
+from time import monotonic
+from zoneinfo import ZoneInfo
 
 # Set the event loop policy to WindowsProactorEventLoopPolicy at the top of the file to fix subprocess support on Windows.
+# Elsewhere use uvloop's libuv-based loop, which is much cheaper per await than the default selector loop.
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+else:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 # Configure Streamlit page
 st.set_page_config(
@@ -35,6 +48,16 @@ load_dotenv()  # Load environment variables from .env (e.g., ANTHROPIC_KEY)
 # GO Transit MCP server URL
 server_url = "http://157.245.115.181:8000/mcp/"
 
+# Claude model for the chat; Haiku is fast and cheap enough for tool lookups and formatting
+MODEL = os.getenv('GO_TRANSIT_MODEL', 'claude-3-5-haiku-20241022')
+
+# Model for the pass that writes the answer from tool results. Picking tools and arguments stays on
+# the fast MODEL; set this to a larger model for better-written answers at the cost of one slower call.
+REPLY_MODEL = os.getenv('GO_TRANSIT_REPLY_MODEL', MODEL)
+
+# GO Transit runs on Toronto time
+EASTERN_TZ = ZoneInfo('America/Toronto')
+
 # Check if API key is loaded
 api_key = os.getenv('ANTHROPIC_KEY')
 if not api_key:
@@ -42,11 +65,52 @@ if not api_key:
 else:
     st.success("Anthropic API key loaded successfully")
 
-# Instantiate Anthropic client
-anthropic_client = anthropic.Anthropic(api_key=api_key)
+# Give up on a response if the stream goes quiet for 30s (the read timeout applies between chunks)
+ANTHROPIC_TIMEOUT = anthropic.Timeout(60.0, read=30.0)
+
+def get_event_loop():
+    """Event loop for this browser session, reused across turns so async clients keep their connections"""
+    if "event_loop" not in st.session_state:
+        st.session_state["event_loop"] = asyncio.new_event_loop()
+    return st.session_state["event_loop"]
+
+# Keep-alive pool for the Anthropic API so follow-up calls in a turn skip the TLS handshake
+ANTHROPIC_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=300)
+
+def get_anthropic_client():
+    """Async Anthropic client for this browser session, bound to its event loop on first use"""
+    if "anthropic_client" not in st.session_state:
+        st.session_state["anthropic_client"] = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            timeout=ANTHROPIC_TIMEOUT,
+            # The SDK's own httpx defaults (redirects, proxies), with an explicit pool
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=ANTHROPIC_HTTP_LIMITS),
+        )
+    return st.session_state["anthropic_client"]
 
-async def load_mcp_tools(client):
-    """Load tools from GO Transit MCP client and convert to Anthropic format"""
+# The station catalog barely changes; every session shares one copy for an hour
+STATIONS_CACHE_TTL = 3600
+
+@st.cache_resource
+def shared_mcp_cache():
+    """Process-wide store for MCP data that is the same for every session (tool list, station catalog)"""
+    return {}
+
+# How to read a tool's result, appended to its server description so it sits with the tool instead of the system prompt
+TRIP_RESULT_RULES = """
+
+SELECTION RULES: trips are returned sorted chronologically by departure time.
+- LATEST/LAST = the LAST item in the returned array (highest departure time) - never the first
+- EARLIEST/FIRST = the FIRST item in the returned array (lowest departure time)
+- NEXT = the first item departing after the current time"""
+
+TOOL_DESCRIPTION_NOTES = {
+    "find_trip": TRIP_RESULT_RULES,
+    "find_trip_with_fare": TRIP_RESULT_RULES,
+}
+
+async def load_mcp_tools(client, quiet=False):
+    """Load tools from GO Transit MCP client and convert to Anthropic format; quiet skips the status banners"""
     try:
         tools = await client.list_tools()
         anthropic_tools = []
@@ -54,49 +118,174 @@ async def load_mcp_tools(client):
         for tool in tools:
             anthropic_tool = {
                 "name": tool.name,
-                "description": tool.description,
+                "description": (tool.description or "") + TOOL_DESCRIPTION_NOTES.get(tool.name, ""),
                 "input_schema": tool.inputSchema,
             }
             anthropic_tools.append(anthropic_tool)
         
-        st.success(f"Loaded {len(anthropic_tools)} GO Transit tools from MCP server")
-        return anthropic_tools
+        # Tools are sent ahead of the system prompt and never change, so cache them as part of the prefix
+        if anthropic_tools:
+            anthropic_tools[-1]["cache_control"] = {"type": "ephemeral"}
+        
+        if not quiet:
+            st.success(f"Loaded {len(anthropic_tools)} GO Transit tools from MCP server")
+        # Shared by every session and sent as-is on every call; a tuple so nothing appends to it in place
+        return tuple(anthropic_tools)
     except Exception as e:
-        st.error(f"Error loading GO Transit tools: {e}")
-        return []
+        if not quiet:
+            st.error(f"Error loading GO Transit tools: {e}")
+        return ()
+
+# Keep MCP connections alive between turns so concurrent tool calls reuse warm sockets
+MCP_HTTP_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=300)
+
+# Multiplex concurrent tool calls over one connection where the server can negotiate it;
+# httpx only speaks HTTP/2 over TLS, so a plain http:// server stays on HTTP/1.1 keep-alive
+MCP_HTTP2 = server_url.startswith("https://")
+
+def mcp_http_client_factory(headers=None, timeout=None, auth=None):
+    """httpx client for the MCP transport - mcp's own defaults plus a keep-alive connection pool"""
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout if timeout is not None else httpx.Timeout(30.0, read=300.0),
+        auth=auth,
+        follow_redirects=True,
+        limits=MCP_HTTP_LIMITS,
+        http2=MCP_HTTP2,
+    )
+
+# The server reports its mcp package version, not the app's, so a redeploy can't be detected from the
+# handshake; the shared tool list is simply re-listed this often so new tools show up without a restart
+TOOLS_CACHE_TTL = 600
+
+async def shared_tools(client, quiet=False):
+    """Tool list shared by every session, re-listed from the server once it is TOOLS_CACHE_TTL old"""
+    cache = shared_mcp_cache()
+    cached = cache.get(("tools", server_url))
+    if cached is not None and monotonic() - cached[0] < TOOLS_CACHE_TTL:
+        return cached[1]
+    
+    tools = await load_mcp_tools(client, quiet)
+    if tools:
+        cache[("tools", server_url)] = (monotonic(), tools)
+        return tools
+    # Keep using the last good list rather than dropping to the fallback schemas
+    return cached[1] if cached is not None else tools
+
+# A session idle this long may have been dropped by the server or a proxy; ping it before reuse
+MCP_IDLE_PING_AFTER = 30
+
+async def connect_mcp_session():
+    """Connected MCP client for this browser session, opened on first use and kept across turns"""
+    session = st.session_state.get("mcp_session")
+    if session is not None and monotonic() - st.session_state.get("mcp_last_used", 0) > MCP_IDLE_PING_AFTER:
+        try:
+            await session.ping()
+        except Exception:
+            # Reconnect now rather than failing the turn over into fallback mode
+            await close_mcp_session()
+            session = None
+    if session is None:
+        client = Client(transport=StreamableHttpTransport(server_url, httpx_client_factory=mcp_http_client_factory))
+        await client.__aenter__()
+        try:
+            # Ping the server to test connection
+            await client.ping()
+        except BaseException:
+            await client.__aexit__(None, None, None)
+            raise
+        session = st.session_state["mcp_session"] = client
+    st.session_state["mcp_last_used"] = monotonic()
+    return session
+
+async def get_mcp_session():
+    """This session's connected MCP client and the tool list"""
+    client = await connect_mcp_session()
+    return client, await shared_tools(client)
+
+async def close_mcp_session():
+    """Drop this session's MCP client so the next turn opens a fresh connection"""
+    session = st.session_state.pop("mcp_session", None)
+    if session is not None:
+        try:
+            await session.__aexit__(None, None, None)
+        except Exception:
+            pass
+
+# Repeat calls within a chat ("trips today Union to Milton", then "what's the last one?") reuse
+# the earlier result. Kept short because find_trip results carry real-time status.
+TOOL_RESULT_CACHE_TTL = 120
+UNCACHED_TOOLS = frozenset(["get_current_datetime"])
+
+def session_tool_cache():
+    if "tool_cache" not in st.session_state:
+        st.session_state["tool_cache"] = TTLCache(maxsize=64, ttl=TOOL_RESULT_CACHE_TTL)
+    return st.session_state["tool_cache"]
 
 async def call_tool(client, tool_name, arguments):
-    """Call a tool on the GO Transit MCP client"""
+    """Call a tool on the GO Transit MCP client, serving get_stations from the shared cache and repeat calls from the session's"""
+    if tool_name in UNCACHED_TOOLS:
+        return await run_tool(client, tool_name, arguments)
+    if tool_name != "get_stations":
+        cache = session_tool_cache()
+        key = (tool_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS))
+        if key in cache:
+            return cache[key]
+        result = await run_tool(client, tool_name, arguments)
+        if not result.startswith("Error:"):
+            cache[key] = result
+        return result
+    
+    cache = shared_mcp_cache()
+    cached = cache.get("stations")
+    if cached is not None and monotonic() - cached[0] < STATIONS_CACHE_TTL:
+        return cached[1]
+    
+    stations = await run_tool(client, tool_name, arguments)
+    if not stations.startswith("Error:"):
+        cache["stations"] = (monotonic(), stations)
+        # Every code in the catalog, so tool arguments can be checked without a round trip
+        cache["station_codes"] = frozenset(STATION_CODE_PATTERN.findall(stations))
+        cache["station_names"] = {normalize_station_name(name): code for name, code in STATION_ENTRY_PATTERN.findall(stations)}
+        cache["station_trie"] = build_station_trie(STATION_ALIASES | cache["station_names"])
+    return stations
+
+# Tool results are read by Claude, not people - compact JSON costs far fewer input tokens.
+# Non-string keys are stringified instead of failing.
+TOOL_RESULT_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# Cap concurrent MCP calls so a response with many tool_use blocks can't flood the server
+MCP_CALL_SLOTS = 8
+
+def mcp_call_slots():
+    """Semaphore for this session's MCP calls, created once with its event loop rather than on every rerun"""
+    if "mcp_call_slots" not in st.session_state:
+        st.session_state["mcp_call_slots"] = asyncio.Semaphore(MCP_CALL_SLOTS)
+    return st.session_state["mcp_call_slots"]
+
+# The server's tools swallow their exceptions and return None, which arrives as one of these
+EMPTY_TOOL_RESULTS = frozenset(["", "null", '{"result":null}'])
+
+async def run_tool(client, tool_name, arguments):
+    """Run a tool on the GO Transit MCP server and render its result as text, or as "Error: ..." if it failed"""
+    text = await render_tool_result(client, tool_name, arguments)
+    if text.strip() in EMPTY_TOOL_RESULTS:
+        return f"Error: {tool_name} returned no data (nothing found, or the GO Transit API request failed)"
+    return text
+
+async def render_tool_result(client, tool_name, arguments):
+    """Run a tool on the GO Transit MCP server and render its result as text"""
     try:
-        result = await client.call_tool(tool_name, arguments)
-        
-        # Handle different result types from MCP server
-        if hasattr(result, 'structured_content') and result.structured_content:
-            import json
-            return json.dumps(result.structured_content, indent=2)
+        async with mcp_call_slots():
+            result = await client.call_tool(tool_name, arguments)
         
-        elif hasattr(result, 'content') and result.content:
-            # Handle content array
-            all_content = []
-            for content_item in result.content:
-                if hasattr(content_item, 'text'):
-                    all_content.append(content_item.text)
+        # fastmcp's Client.call_tool returns a CallToolResult; structured output is the common case
+        if isinstance(result, CallToolResult):
+            if result.structured_content:
+                return orjson.dumps(result.structured_content, option=TOOL_RESULT_JSON_OPTIONS).decode()
             
-            # If it's a single string, return it directly
-            if len(all_content) == 1:
-                return all_content[0]
-            else:
-                # Multiple content items - combine them
-                return "\n".join(all_content)
-        
-        elif hasattr(result, 'text'):
-            # Direct text attribute
-            return result.text
-        
-        elif isinstance(result, dict):
-            # Dictionary result
-            import json
-            return json.dumps(result, indent=2, default=str)
+            # Otherwise combine the text content items
+            return "\n".join(item.text for item in result.content if isinstance(item, TextContent))
         
         elif isinstance(result, str):
             # String result
@@ -104,40 +293,182 @@ async def call_tool(client, tool_name, arguments):
         
         else:
             # Last resort fallback
-            import json
-            return json.dumps(result, indent=2, default=str)
+            return orjson.dumps(result, default=str, option=TOOL_RESULT_JSON_OPTIONS).decode()
             
     except Exception as e:
         st.error(f"GO Transit tool call failed: {e}")
         return f"Error: {str(e)}"
 
-async def chat_with_claude(messages, tools):
-    """Send messages to Claude and get response"""
-    try:
-        # Get current EST datetime for context
-        eastern = pytz.timezone('America/Toronto')
-        current_time = datetime.now(eastern)
-        current_datetime_str = current_time.strftime("%A, %B %d, %Y at %I:%M %p %Z")
-        current_day = current_time.strftime("%A")
-        tomorrow_day = (current_time + timedelta(days=1)).strftime("%A")
-        current_date = current_time.strftime("%Y%m%d")
-        tomorrow_date = (current_time + timedelta(days=1)).strftime("%Y%m%d")
+# Codes for the stations people ask about most, baked into the prompt so a trip query
+# doesn't need a get_stations() round trip first
+STATION_CODES = {
+    "UN": "Union Station",
+    "ML": "Milton GO",
+    "MI": "Mississauga GO",
+    "BR": "Brampton GO",
+    "OA": "Oakville GO",
+    "BU": "Burlington GO",
+    "HA": "Hamilton GO Centre",
+    "GE": "Georgetown GO",
+    "KI": "Kitchener GO",
+    "GL": "Guelph Central GO",
+    "OS": "Durham College Oshawa GO",
+    "PA": "Pearson Airport Terminal 1",
+    "MU": "McMaster University",
+    "WW": "Major Mackenzie West Bus Terminal",
+}
+
+STATION_TABLE = "\n".join(
+    ["            | Code | Station |", "            |------|---------|"]
+    + [f"            | {code} | {name} |" for code, name in STATION_CODES.items()]
+)
+
+# Informal names people use for the baked-in stations, on top of the names themselves
+STATION_NICKNAMES = {
+    "union": "UN",
+    "oshawa": "OS",
+    "durham college": "OS",
+    "airport": "PA",
+    "pearson": "PA",
+    "mcmaster": "MU",
+    "wonderland": "WW",
+    "hamilton": "HA",
+    "guelph": "GL",
+}
+
+def normalize_station_name(name):
+    """Lowercase a station name and drop the words that don't tell stations apart"""
+    words = name.lower().replace("-", " ").split()
+    while len(words) > 1 and words[-1] in ("station", "stn", "go", "centre", "central"):
+        words.pop()
+    return " ".join(words)
+
+# Normalized name -> code for the baked-in stations; get_stations() names are added as the catalog loads
+STATION_ALIASES = {normalize_station_name(name): code for code, name in STATION_CODES.items()} | STATION_NICKNAMES
+
+def build_station_trie(names):
+    """Character trie over normalized station names; a node's None key holds the code of the name ending there"""
+    root = {}
+    for name, code in names.items():
+        node = root
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = code
+    return root
+
+def codes_with_prefix(trie, prefix):
+    """Codes of every name in the trie that starts with prefix"""
+    node = trie
+    for char in prefix:
+        node = node.get(char)
+        if node is None:
+            return set()
+    
+    codes = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for key, child in node.items():
+            if key is None:
+                codes.add(child)
+            else:
+                stack.append(child)
+    return codes
+
+# Shorter prefixes ("m", "br") say too little about which station is meant
+STATION_PREFIX_MIN_LENGTH = 3
+
+# Most typos a misspelled name may have before it is no longer taken for a station;
+# short names get fewer so "du" can't turn into some other two-letter-off word
+STATION_MAX_EDITS = 2
+STATION_SHORT_NAME_LENGTH = 5
+
+def stations_within_edits(trie, word, max_edits):
+    """(edit distance, code) for every name in the trie within max_edits of word, nearest first.
+    
+    Walks the trie computing one Levenshtein row per node, so names sharing a prefix share its
+    rows, and stops descending once every cell of a row is over max_edits.
+    """
+    matches = []
+    first_row = list(range(len(word) + 1))
+    stack = [(child, char, first_row) for char, child in trie.items() if char is not None]
+    while stack:
+        node, char, previous = stack.pop()
+        row = [previous[0] + 1]
+        for i, letter in enumerate(word, 1):
+            row.append(min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (letter != char)))
         
-        # Ensure system message is always present and first
-        system_prompt = f"""
-            You are a professional GO Transit assistant helping customers with train schedules, fares, and route planning in the Greater Toronto Area (GTA) and surrounding regions. You have access to the GO Transit MCP server.
+        if None in node and row[-1] <= max_edits:
+            matches.append((row[-1], node[None]))
+        if min(row) <= max_edits:
+            stack.extend((child, key, row) for key, child in node.items() if key is not None)
+    return sorted(matches)
 
-            ## CURRENT DATE/TIME CONTEXT:
-            **Current Date/Time: {current_datetime_str}**
-            **Today is: {current_day}**
-            **Current Date (YYYYMMDD): {current_date}**
-            **Tomorrow Date (YYYYMMDD): {tomorrow_date}**
+def resolve_station(value):
+    """Map a station code or (informal, possibly misspelled) name to a station code, or return it unchanged"""
+    value = str(value).strip()
+    catalog = shared_mcp_cache().get("station_names", {})
+    if value in STATION_CODES or value in catalog.values():
+        return value
+    
+    name = normalize_station_name(value)
+    code = STATION_ALIASES.get(name) or catalog.get(name)
+    if code:
+        return code
+    
+    # Partial and misspelled names are only matched against the full catalog: against just the
+    # baked-in stations, a real station missing from the table ("Malton") would become a nearby one (Milton)
+    trie = shared_mcp_cache().get("station_trie")
+    if trie is None:
+        return value
+    
+    # A name cut short ("missis", "burl") is fine as long as only one station starts with it
+    if len(name) >= STATION_PREFIX_MIN_LENGTH:
+        codes = codes_with_prefix(trie, name)
+        if len(codes) == 1:
+            return codes.pop()
+    
+    # Misspelled ("missisauga", "kitchner"): take the nearest name unless another station is just as near
+    max_edits = 1 if len(name) <= STATION_SHORT_NAME_LENGTH else STATION_MAX_EDITS
+    matches = stations_within_edits(trie, name, max_edits)
+    if matches:
+        best = matches[0][0]
+        codes = {code for distance, code in matches if distance == best}
+        if len(codes) == 1:
+            return codes.pop()
+    return value
 
-            Use this information to interpret relative time requests:
-            - "today" = {current_day} (date: {current_date})
-            - "tomorrow" = {tomorrow_day} (date: {tomorrow_date})
-            - "next" = find the next available departure after current time
-            - "in a few hours" = consider current time is {current_time.strftime("%I:%M %p")}
+def resolve_tool_stations(tool_name, arguments):
+    """Return find_trip/get_fare arguments with their stations resolved to codes"""
+    if tool_name not in VALIDATED_TOOLS:
+        return arguments
+    key = VALIDATED_TOOLS[tool_name][0]
+    args = arguments.get(key)
+    if not isinstance(args, dict):
+        return arguments
+    resolved = {**args}
+    for field in ("from_station", "to_station"):
+        if resolved.get(field):
+            resolved[field] = resolve_station(resolved[field])
+    return {**arguments, key: resolved}
+
+# All the baked-in station aliases in one alternation, longest first so "durham college oshawa" wins over "oshawa"
+STATION_MENTION_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(alias) for alias in sorted(STATION_ALIASES, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+def find_station_mentions(text):
+    """Codes of the baked-in stations named in text, in order of first mention, in one pass over it"""
+    codes = {}
+    for match in STATION_MENTION_PATTERN.finditer(text):
+        codes.setdefault(STATION_ALIASES[match.group(1).lower()], match.group(1))
+    return codes
+
+# Everything in the system prompt except the date/time context. Built once and kept
+# byte-identical across calls so Anthropic's prompt cache can reuse it.
+STATIC_SYSTEM_PROMPT = """
+            You are a professional GO Transit assistant helping customers with train schedules, fares, and route planning in the Greater Toronto Area (GTA) and surrounding regions. You have access to the GO Transit MCP server.
 
             ## Core Instructions:
             - Provide accurate, helpful information about GO Transit services
@@ -145,21 +476,11 @@ async def chat_with_claude(messages, tools):
             - Always use the available tools to get real-time schedule and fare data
 
             ## CRITICAL TIME INTERPRETATION RULES (MUST FOLLOW):
-             **LATEST/LAST** = Last departure of the day (HIGHEST time value) - ALWAYS pick the LAST item in the list
-             **EARLIEST/FIRST** = First departure of the day (LOWEST time value) - ALWAYS pick the FIRST item in the list
-             **NEXT** = First available departure after current time
-
-             IMPORTANT: When trip data is returned, it is sorted chronologically by departure time:
-             - First item in array = earliest departure time (e.g., 15:40)
-             - Last item in array = latest departure time (e.g., 19:10)
+             Picking the LATEST/LAST, EARLIEST/FIRST or NEXT trip from a result: see the SELECTION RULES in the find_trip tool description.
 
-             **TODAY** = {current_day} (date: {current_date})
-             **TOMORROW** = {tomorrow_day} (date: {tomorrow_date})
+             **TODAY** and **TOMORROW** = the days and dates given in the CURRENT DATE/TIME CONTEXT block
              
              IMPORTANT: If the user does not specify the day, you must choose the current day by default.
-             
-             FOR "LATEST" OR "LAST" QUERIES: You MUST select the final item in the array with the highest departure time.
-             NEVER select the first item when asked for "latest" or "last" - this is wrong!
 
             ## TEMPORAL ORDERING RULES (CRITICAL FOR CONVERSATION CONTEXT):
             When users ask for "next", "after", "before", "previous", or reference previous trips:
@@ -193,48 +514,46 @@ async def chat_with_claude(messages, tools):
             "The **latest train** from Union Station to Milton on Monday departs at **7:10 PM** and arrives at **8:10 PM** (1 hour journey, Trip ID: 20250825-MI-2749)."
 
             ## Available Tools:
-            - get_stations: Get the complete list of all GO Transit stations, bus stops, and transit hubs
+            - get_stations: Get the complete list of all GO Transit stations, bus stops, and transit hubs (only needed for stations not in the STATION CODES table)
             - find_trip: Get train schedules between locations for specific dates and times (includes real-time status)
             - get_fare: Calculate fare costs between two locations
+            - find_trip_with_fare: Get the schedules and the fare between two locations in one call
             - get_current_datetime: Get current EST date/time for complex time calculations
             
-            **IMPORTANT: For trip searches, you MUST call both get_stations() AND find_trip() in sequence. Do not stop after get_stations().**
-            
             **TOOL ARGUMENT FORMATS:**
-            - get_stations(): Use empty arguments {{}}
-            - find_trip(): Use {{"trip": {{"date": "YYYYMMDD", "from_station": "CODE", "to_station": "CODE"}}}}
-            - get_fare(): Use {{"fare_request": {{"from_station": "CODE", "to_station": "CODE"}}}}
-            - get_current_datetime(): Use empty arguments {{}}
+            - get_stations(): Use empty arguments {}
+            - find_trip(): Use {"trip": {"date": "YYYYMMDD", "from_station": "CODE", "to_station": "CODE"}}
+            - get_fare(): Use {"fare_request": {"from_station": "CODE", "to_station": "CODE"}}
+            - find_trip_with_fare(): Same arguments as find_trip()
+            - get_current_datetime(): Use empty arguments {}
 
             ## WORKFLOW FOR TRIP SEARCHES:
-            1. **ALWAYS call get_stations() first** to get the complete station list
-            2. Parse the returned comma-separated string to find the correct station codes
-            3. **IMMEDIATELY call find_trip() with those station codes** - do not wait or ask for confirmation
-            4. For fare queries, also call get_stations() first to get correct station codes
-            
-            **CRITICAL: When a user asks for trips between locations, you MUST make BOTH tool calls in sequence:**
-            - First: get_stations() 
-            - Second: find_trip() with the station codes you found
-            - Do not stop after get_stations() - always continue to find_trip()
+            1. Look up the station codes in the STATION CODES table below
+            2. **IMMEDIATELY call find_trip() with those station codes** - do not wait or ask for confirmation
+            3. Only call get_stations() when a station the user names is not in the table
+            4. For fare queries, find the codes the same way and call get_fare()
+            5. When the user wants both times and prices, call find_trip_with_fare() instead of find_trip() and get_fare()
             
             **EXAMPLE WORKFLOW:**
             User: "Find trips from Milton to Union"
             You MUST:
-            1. Call get_stations() 
-            2. Find "Milton GO - ML" and "Union Station GO - UN" in the response
-            3. Call find_trip with arguments: {{"trip": {{"date": "20250902", "from_station": "ML", "to_station": "UN"}}}}
-            4. Present the trip results to the user
-            
-            **NEVER stop after step 1 - always complete steps 2, 3, and 4!**
+            1. Find "ML" (Milton GO) and "UN" (Union Station) in the STATION CODES table
+            2. Call find_trip with arguments: {"trip": {"date": "20250902", "from_station": "ML", "to_station": "UN"}}
+            3. Present the trip results to the user
             
             **CRITICAL: The find_trip tool expects arguments in this exact format:**
-            {{"trip": {{"date": "YYYYMMDD", "from_station": "CODE", "to_station": "CODE"}}}}
+            {"trip": {"date": "YYYYMMDD", "from_station": "CODE", "to_station": "CODE"}}
 
             ## CRITICAL STATION NAME RULES:
             YOU MUST ONLY USE EXACT STATION CODES FROM THE OFFICIAL LIST. When users say informal names, map them to the correct official station codes.
             
+            ## STATION CODES:
+""" + STATION_TABLE + """
+            
+            Informal names for the stations in the table ("Union", "Oshawa", "Pearson") are resolved to codes before a call is made. For any other station, call get_stations() and use the code it lists.
+            
             ## STATION DATA FORMAT:
-            The get_stations() function returns a simple comma-separated string in this format:
+            For stations not in the table, get_stations() returns a simple comma-separated string in this format:
             "Station Name - StationCode, Another Station - AnotherCode"
             
             Example: "Hamilton GO Centre - 00141, Union Station GO - UN"
@@ -244,42 +563,12 @@ async def chat_with_claude(messages, tools):
             2. Extract the code that comes after the dash (-)
             3. Use that exact code in your find_trip() or get_fare() calls
             
-            **CRITICAL MAPPING EXAMPLES:**
-            - User says "Union" or "Union Station" → Use "UN" (Union Station)
-            - User says "Milton" or "Milton GO" → Use "ML" (Milton GO)
-            - User says "Mississauga" or "Mississauga GO" → Use "MI" (Mississauga GO)
-            - User says "Brampton" or "Brampton GO" → Use "BR" (Brampton GO)
-            - User says "Oakville" or "Oakville GO" → Use "OA" (Oakville GO)
-            - User says "Burlington" or "Burlington GO" → Use "BU" (Burlington GO)
-            - User says "Hamilton" or "Hamilton GO" → Use "HA" (Hamilton GO Centre)
-            - User says "Georgetown" or "Georgetown GO" → Use "GE" (Georgetown GO)
-            - User says "Kitchener" or "Kitchener GO" → Use "KI" (Kitchener GO)
-            - User says "Guelph" or "Guelph GO" → Use "GL" (Guelph Central GO)
-            - User says "Oshawa" or "Oshawa GO" → Use "OS" (Durham College Oshawa GO)
-            - User says "Airport" or "Pearson" → Use "PA" (Pearson Airport Terminal 1)
-            - User says "McMaster" → Use "MU" (McMaster University)
-            - User says "Wonderland" → Use "WW" (Major Mackenzie West Bus Terminal)
-            
-            **COMMON STATION CODES:**
-            - UN = Union Station
-            - ML = Milton GO
-            - MI = Mississauga GO
-            - BR = Brampton GO
-            - OA = Oakville GO
-            - BU = Burlington GO
-            - HA = Hamilton GO Centre
-            - GE = Georgetown GO
-            - KI = Kitchener GO
-            - GL = Guelph Central GO
-            - OS = Durham College Oshawa GO
-            - PA = Pearson Airport Terminal 1
-            
-            NEVER invent station codes - only use exact matches from the official list returned by get_stations(). When users say informal names, always map to exact official station codes.
+            NEVER invent station codes - only use codes from the STATION CODES table or the official list returned by get_stations(). When users say informal names, always map to exact official station codes.
 
             ## DATE FORMAT REQUIREMENTS:
             - All dates must be in YYYYMMDD format (e.g., '20250902' for September 2, 2025)
-            - Use current date ({current_date}) for "today"
-            - Use tomorrow date ({tomorrow_date}) for "tomorrow"
+            - Use the current date from the CURRENT DATE/TIME CONTEXT block for "today"
+            - Use the tomorrow date from the CURRENT DATE/TIME CONTEXT block for "tomorrow"
             - For specific dates, convert to YYYYMMDD format
 
             ## TIME FORMAT REQUIREMENTS:
@@ -290,336 +579,622 @@ async def chat_with_claude(messages, tools):
             - If no trips found, suggest checking station names or trying different days
             - If connection fails, apologize and suggest trying again
             - For unclear requests, ask for clarification on origin, destination, and timing
+"""
+
+# Sent as-is on every call - the same object each time, marked as a prompt-cache breakpoint
+STATIC_SYSTEM_BLOCK = {"type": "text", "text": STATIC_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+
+# Rough cap on the conversation history sent with each call, and how many user turns to keep at most
+HISTORY_TOKEN_BUDGET = 8000
+HISTORY_MAX_TURNS = 6
+
+STALE_TOOL_RESULT = "[omitted: stale]"
+
+def estimate_tokens(message):
+    """Cheap ~4 characters per token estimate of a message's size"""
+    content = message["content"]
+    if isinstance(content, str):
+        return len(content) // 4
+    
+    chars = 0
+    for block in content:
+        if isinstance(block, dict):
+            chars += len(str(block.get("content", "")))
+        else:
+            chars += len(getattr(block, "text", None) or str(getattr(block, "input", "")))
+    return chars // 4
+
+def trim_messages(messages, max_tokens=HISTORY_TOKEN_BUDGET, keep_last=HISTORY_MAX_TURNS):
+    """
+    Keep the most recent turns within a token budget. Old tool results go first, then whole
+    turns from the front; the current turn is always kept whole.
+    """
+    # A turn starts at each plain-text user message; tool_result turns belong to the one before
+    turns = []
+    for message in messages:
+        if not turns or (message["role"] == "user" and isinstance(message["content"], str)):
+            turns.append([])
+        turns[-1].append(message)
+    turns = turns[-keep_last:]
+    
+    total = sum(estimate_tokens(message) for turn in turns for message in turn)
+    
+    # Stale find_trip/get_stations JSON is the bulk of the history; stub it out oldest first
+    for turn in turns[:-1]:
+        if total <= max_tokens:
+            break
+        for i, message in enumerate(turn):
+            if message["role"] == "user" and not isinstance(message["content"], str):
+                stubbed = {
+                    "role": "user",
+                    "content": [{**block, "content": STALE_TOOL_RESULT} for block in message["content"]],
+                }
+                total += estimate_tokens(stubbed) - estimate_tokens(message)
+                turn[i] = stubbed
+    
+    # Still too big: drop the oldest turns entirely, so the history still opens with a user message
+    while len(turns) > 1 and total > max_tokens:
+        total -= sum(estimate_tokens(message) for message in turns.pop(0))
+    
+    return [message for turn in turns for message in turn]
+
+def with_cache_breakpoint(messages):
+    """
+    Mark the last message as a prompt-cache breakpoint, so each tool round trip in a turn
+    only pays full price for what was added since the previous call.
+    """
+    if not messages:
+        return messages
+    
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [block if isinstance(block, dict) else block.model_dump(exclude_none=True) for block in content]
+    
+    # Copy rather than mutate - the session history is reused on later turns
+    blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+    return messages[:-1] + [{"role": last["role"], "content": blocks}]
+
+@lru_cache(maxsize=2)
+def day_strings(today):
+    """Day names and YYYYMMDD dates for today and tomorrow - they only change once a day"""
+    tomorrow = today + timedelta(days=1)
+    return today.strftime("%A"), today.strftime("%Y%m%d"), tomorrow.strftime("%A"), tomorrow.strftime("%Y%m%d")
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# Relative and named days people use; each maps to days from today given today's weekday
+DAY_OFFSETS = {
+    "today": lambda weekday: [0],
+    "tonight": lambda weekday: [0],
+    "tomorrow": lambda weekday: [1],
+    # The coming weekend, or the current one when today is Saturday or Sunday
+    "weekend": lambda weekday: [-1, 0] if weekday == 6 else [5 - weekday, 6 - weekday],
+} | {day: (lambda weekday, index=index: [(index - weekday) % 7]) for index, day in enumerate(WEEKDAYS)}
+
+DAY_MENTION_PATTERN = re.compile(r"\b(" + "|".join(DAY_OFFSETS) + r")\b", re.IGNORECASE)
+
+def find_day_mentions(text, today):
+    """Day words in text mapped to the 'Weekday YYYYMMDD' dates they mean, counting from today"""
+    days = {}
+    for match in DAY_MENTION_PATTERN.finditer(text):
+        word = match.group(1).lower()
+        if word not in days:
+            dates = [today + timedelta(days=offset) for offset in DAY_OFFSETS[word](today.weekday())]
+            days[word] = ", ".join(date.strftime("%A %Y%m%d") for date in dates)
+    return days
+
+async def chat_with_claude(messages, tools, placeholder=None, model=MODEL):
+    """Send messages to Claude and get response, streaming text into placeholder as it arrives"""
+    try:
+        # Get current EST datetime for context; only the time of day needs formatting every call
+        current_time = datetime.now(EASTERN_TZ)
+        current_datetime_str = current_time.strftime("%A, %B %d, %Y at %I:%M %p %Z")
+        current_day, current_date, tomorrow_day, tomorrow_date = day_strings(current_time.date())
+        current_time_str = current_time.strftime("%I:%M %p")
+        
+        # Only the date/time context changes between calls; it follows the cached static prompt
+        date_context = f"""
+            ## CURRENT DATE/TIME CONTEXT:
+            **Current Date/Time: {current_datetime_str}**
+            **Today is: {current_day}**
+            **Current Date (YYYYMMDD): {current_date}**
+            **Tomorrow Date (YYYYMMDD): {tomorrow_date}**
+
+            Use this information to interpret relative time requests:
+            - "today" = {current_day} (date: {current_date})
+            - "tomorrow" = {tomorrow_day} (date: {tomorrow_date})
+            - "next" = find the next available departure after current time
+            - "in a few hours" = consider current time is {current_time_str}
         """
         
+        # Stations and days already recognized in the question, so Claude can go straight to find_trip/get_fare
+        question = next((msg["content"] for msg in reversed(messages) if msg["role"] == "user" and isinstance(msg["content"], str)), "")
+        mentions = find_station_mentions(question)
+        if mentions:
+            date_context += "\n            ## STATIONS IN THIS QUESTION:\n" + "\n".join(
+                f'            - "{said}" = {code} ({STATION_CODES[code]})' for code, said in mentions.items()
+            )
+        days = find_day_mentions(question, current_time.date())
+        if days:
+            date_context += "\n            ## DAYS IN THIS QUESTION:\n" + "\n".join(
+                f'            - "{word}" = {dates}' for word, dates in days.items()
+            )
+        
+        system_prompt = [
+            STATIC_SYSTEM_BLOCK,
+            {"type": "text", "text": date_context},
+        ]
+        
         # Filter out system messages and prepare for Claude API
-        filtered_messages = [msg for msg in messages if msg["role"] != "system"]
+        filtered_messages = with_cache_breakpoint(trim_messages([msg for msg in messages if msg["role"] != "system"]))
         
-        response = anthropic_client.messages.create(
-            model='claude-3-5-haiku-20241022',
+        async with get_anthropic_client().messages.stream(
+            model=model,
             max_tokens=4096,
             system=system_prompt,
             messages=filtered_messages,
             tools=tools,
-        )
+        ) as stream:
+            # Show text as it is generated instead of waiting for the whole response
+            if placeholder is not None:
+                partial_text = ""
+                async for text in stream.text_stream:
+                    partial_text += text
+                    placeholder.markdown(partial_text + "▌")
+                placeholder.markdown(partial_text)
+            
+            # Same Message object messages.create would have returned, tool_use blocks included
+            response = await stream.get_final_message()
+        
         # Return the response object directly - we'll handle content extraction in the calling code
         return response
-    except Exception as e:
+    except anthropic.APIError as e:
+        # Raised, not turned into a reply, so the caller can tell it apart from an MCP failure
         st.error(f"Claude API error: {e}")
-        return {"role": "assistant", "content": f"Sorry, I encountered a Claude API error: {str(e)}"}
+        raise
 
-def sync_chat_response(messages, user_input):
-    """Synchronous wrapper for the async chat logic for GO Transit queries"""
-    async def _chat():
-        try:
-            # Create transport and client
-            transport = StreamableHttpTransport(server_url)
-            
-            async with Client(transport=transport) as client:
-                # Ping the server to test connection
-                await client.ping()
-                
-                # Load tools from server
-                tools = await load_mcp_tools(client)
-                
-                if not tools:
-                    st.warning("No GO Transit tools found. Using fallback mode.")
-                    tools = [
-                        {
-                            "name": "get_stations",
-                            "description": "Get the complete list of all GO Transit stations",
-                            "input_schema": {
-                                "type": "object",
-                                "properties": {},
-                                "required": []
-                            }
+DATE_PATTERN = re.compile(r"\d{8}")
+TIME_PATTERN = re.compile(r"\d{4}")
+
+# Codes in the get_stations() "Name - CODE, Name - CODE" string
+STATION_CODE_PATTERN = re.compile(r" - ([A-Za-z0-9]+)(?=,|\"|$)")
+STATION_ENTRY_PATTERN = re.compile(r"([^,\"]+?) - ([A-Za-z0-9]+)(?=,|\"|$)")
+
+# Tool name -> (argument wrapper key, required fields)
+VALIDATED_TOOLS = {
+    "find_trip": ("trip", ("date", "from_station", "to_station")),
+    "find_trip_with_fare": ("trip", ("date", "from_station", "to_station")),
+    "get_fare": ("fare_request", ("from_station", "to_station")),
+}
+
+def validate_tool_arguments(tool_name, arguments):
+    """Return why a find_trip/get_fare call could only fail, or None if its arguments look valid"""
+    if tool_name not in VALIDATED_TOOLS:
+        return None
+    
+    key, required = VALIDATED_TOOLS[tool_name]
+    args = arguments.get(key)
+    if not isinstance(args, dict):
+        return f"arguments must be wrapped in a '{key}' object"
+    
+    for field in required:
+        if not args.get(field):
+            return f"'{field}' is required"
+    
+    if "date" in args and not DATE_PATTERN.fullmatch(str(args["date"])):
+        return f"date '{args['date']}' is not in YYYYMMDD format"
+    if args.get("time") and not TIME_PATTERN.fullmatch(str(args["time"])):
+        return f"time '{args['time']}' is not in HHMM format"
+    
+    # Only reject a code once the full catalog is known; the baked-in table is just the common ones
+    catalog_codes = shared_mcp_cache().get("station_codes")
+    if catalog_codes:
+        for field in ("from_station", "to_station"):
+            code = args[field]
+            if code not in STATION_CODES and code not in catalog_codes:
+                return f"unknown station code '{code}'"
+    
+    return None
+
+async def run_tool_calls(client, tool_uses):
+    """Run tool calls concurrently, with a status badge per call that completes when its result arrives"""
+    statuses = []
+    for tool_use in tool_uses:
+        status = st.status(f"Calling {tool_use.name}…", state="running")
+        status.write(f"Arguments: {tool_use.input}")
+        statuses.append(status)
+    
+    async def _call(tool_use, status):
+        arguments = resolve_tool_stations(tool_use.name, tool_use.input)
+        # Bad arguments would only earn an error from the server; report them without the round trip
+        problem = validate_tool_arguments(tool_use.name, arguments)
+        if problem:
+            result = f"Error: Invalid arguments: {problem}. Common station codes: {', '.join(STATION_CODES)}; call get_stations() for the full list."
+        else:
+            result = await call_tool(client, tool_use.name, arguments)
+        if result.startswith("Error:"):
+            status.update(label=f"{tool_use.name} failed", state="error")
+        else:
+            status.update(label=f"Called {tool_use.name}", state="complete")
+        return result
+    
+    results = await asyncio.gather(*(_call(tool_use, status) for tool_use, status in zip(tool_uses, statuses)), return_exceptions=True)
+    
+    # One failed call shouldn't lose the others' results; Claude still needs a tool_result for each
+    return [f"Error: {result}" if isinstance(result, Exception) else result for result in results]
+
+def split_response(response):
+    """Split a Claude response into its joined text and its tool_use blocks in one pass"""
+    text_parts = []
+    tool_uses = []
+    for block in response.content:
+        block_type = getattr(block, 'type', None)
+        if block_type == 'text':
+            text_parts.append(block.text)
+        elif block_type == 'tool_use':
+            tool_uses.append(block)
+    return "".join(text_parts), tool_uses
+
+def tool_results_message(tool_uses, tool_results):
+    """User turn answering each tool_use block with a tool_result block, in the order Claude asked"""
+    return {
+        "role": "user",
+        "content": [
+            {"type": "tool_result", "tool_use_id": tool_use.id, "content": tool_result}
+            for tool_use, tool_result in zip(tool_uses, tool_results)
+        ],
+    }
+
+# Tool schemas to fall back on when the server lists no tools
+FALLBACK_TOOLS_FULL = (
+    {
+        "name": "get_stations",
+        "description": "Get the complete list of all GO Transit stations",
+        "input_schema": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    },
+    {
+        "name": "find_trip",
+        "description": "Find GO Transit trips between locations with real-time status" + TRIP_RESULT_RULES,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "trip": {
+                    "type": "object",
+                    "properties": {
+                        "date": {
+                            "type": "string",
+                            "description": "Date in YYYYMMDD format"
+                        },
+                        "from_station": {
+                            "type": "string",
+                            "description": "Origin station code"
                         },
-                        {
-                            "name": "find_trip",
-                            "description": "Find GO Transit trips between locations with real-time status",
-                            "input_schema": {
-                                "type": "object",
-                                "properties": {
-                                    "trip": {
-                                        "type": "object",
-                                        "properties": {
-                                            "date": {
-                                                "type": "string",
-                                                "description": "Date in YYYYMMDD format"
-                                            },
-                                            "from_station": {
-                                                "type": "string",
-                                                "description": "Origin station code"
-                                            },
-                                            "to_station": {
-                                                "type": "string",
-                                                "description": "Destination station code"
-                                            },
-                                            "time": {
-                                                "type": "string",
-                                                "description": "Time in HHMM format"
-                                            },
-                                            "max_results": {
-                                                "type": "string",
-                                                "description": "Maximum number of results"
-                                            }
-                                        },
-                                        "required": ["date", "from_station", "to_station"]
-                                    }
-                                },
-                                "required": ["trip"]
-                            }
+                        "to_station": {
+                            "type": "string",
+                            "description": "Destination station code"
                         },
-                        {
-                            "name": "get_fare",
-                            "description": "Get fare information between two GO Transit locations",
-                            "input_schema": {
-                                "type": "object",
-                                "properties": {
-                                    "fare_request": {
-                                        "type": "object",
-                                        "properties": {
-                                            "from_station": {
-                                                "type": "string",
-                                                "description": "Origin station code"
-                                            },
-                                            "to_station": {
-                                                "type": "string",
-                                                "description": "Destination station code"
-                                            }
-                                        },
-                                        "required": ["from_station", "to_station"]
-                                    }
-                                },
-                                "required": ["fare_request"]
-                            }
+                        "time": {
+                            "type": "string",
+                            "description": "Time in HHMM format"
                         },
-                        {
-                            "name": "get_current_datetime",
-                            "description": "Get current date and time in Eastern Time",
-                            "input_schema": {
-                                "type": "object",
-                                "properties": {},
-                                "required": []
-                            }
+                        "max_results": {
+                            "type": "string",
+                            "description": "Maximum number of results"
                         }
-                    ]
-                
-                # Add user message
-                messages.append({"role": "user", "content": user_input})
-                
-                # Get response from Claude
-                response = await chat_with_claude(messages, tools)
-                
-                # Extract text content from response and add to messages
-                text_content = ""
-                for content_item in response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'text':
-                        text_content += content_item.text
-                
-                # Add assistant response to messages
-                messages.append({"role": "assistant", "content": text_content})
-                
-                # Handle tool calls with support for multiple sequential calls
-                tool_uses = []
-                for content_item in response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                        tool_uses.append(content_item)
-                
-                if tool_uses:
-                    # Process all tool calls in sequence
-                    for tool_use in tool_uses:
-                        # Call the tool on the GO Transit MCP server
-                        arguments = tool_use.input
-                        st.info(f"Calling {tool_use.name} with arguments: {arguments}")
-                        
-                        tool_result = await call_tool(client, tool_use.name, arguments)
-                        
-                        # Add tool response to messages
-                        messages.append({
-                            "role": "user",
-                            "content": f"Tool result for {tool_use.name}: {tool_result}"
-                        })
-                    
-                    # After all tool calls are complete, get the final response from Claude
-                    # This allows Claude to process all tool results and make additional tool calls if needed
-                    final_response = await chat_with_claude(messages, tools)
-                    
-                    # Extract text content and add to messages
-                    final_text_content = ""
-                    for content_item in final_response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'text':
-                            final_text_content += content_item.text
-                    
-                    messages.append({"role": "assistant", "content": final_text_content})
-                    
-                    # Check if the final response also has tool calls (for multi-step workflows)
-                    final_tool_uses = []
-                    for content_item in final_response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                            final_tool_uses.append(content_item)
-                    
-                    while final_tool_uses:
-                        st.info("Processing additional tool calls...")
-                        
-                        # Process the additional tool calls
-                        for tool_use in final_tool_uses:
-                            arguments = tool_use.input
-                            st.info(f"Calling {tool_use.name} with arguments: {arguments}")
-                            
-                            tool_result = await call_tool(client, tool_use.name, arguments)
-                            
-                            # Add tool response to messages
-                            messages.append({
-                                "role": "user",
-                                "content": f"Tool result for {tool_use.name}: {tool_result}"
-                            })
-                        
-                        # Get the next response from Claude
-                        final_response = await chat_with_claude(messages, tools)
-                        
-                        # Extract text content and add to messages
-                        final_text_content = ""
-                        for content_item in final_response.content:
-                            if hasattr(content_item, 'type') and content_item.type == 'text':
-                                final_text_content += content_item.text
-                        
-                        messages.append({"role": "assistant", "content": final_text_content})
-                        
-                        # Check for more tool uses
-                        final_tool_uses = []
-                        for content_item in final_response.content:
-                            if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                                final_tool_uses.append(content_item)
-                    
-                    # Extract text content from final response
-                    text_content = ""
-                    for content_item in final_response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'text':
-                            text_content += content_item.text
-                    
-                    return text_content, messages
-                else:
-                    # Extract text content from response
-                    text_content = ""
-                    for content_item in response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'text':
-                            text_content += content_item.text
-                    
-                    return text_content, messages
+                    },
+                    "required": ["date", "from_station", "to_station"]
+                }
+            },
+            "required": ["trip"]
+        }
+    },
+    {
+        "name": "find_trip_with_fare",
+        "description": "Find GO Transit trips between locations with real-time status, plus the fare" + TRIP_RESULT_RULES,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "trip": {
+                    "type": "object",
+                    "properties": {
+                        "date": {
+                            "type": "string",
+                            "description": "Date in YYYYMMDD format"
+                        },
+                        "from_station": {
+                            "type": "string",
+                            "description": "Origin station code"
+                        },
+                        "to_station": {
+                            "type": "string",
+                            "description": "Destination station code"
+                        },
+                        "time": {
+                            "type": "string",
+                            "description": "Time in HHMM format"
+                        },
+                        "max_results": {
+                            "type": "string",
+                            "description": "Maximum number of results"
+                        }
+                    },
+                    "required": ["date", "from_station", "to_station"]
+                }
+            },
+            "required": ["trip"]
+        }
+    },
+    {
+        "name": "get_fare",
+        "description": "Get fare information between two GO Transit locations",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "fare_request": {
+                    "type": "object",
+                    "properties": {
+                        "from_station": {
+                            "type": "string",
+                            "description": "Origin station code"
+                        },
+                        "to_station": {
+                            "type": "string",
+                            "description": "Destination station code"
+                        }
+                    },
+                    "required": ["from_station", "to_station"]
+                }
+            },
+            "required": ["fare_request"]
+        }
+    },
+    {
+        "name": "get_current_datetime",
+        "description": "Get current date and time in Eastern Time",
+        "input_schema": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    }
+)
+
+# Reply while the GO Transit MCP server is unreachable; without its tools Claude has nothing to look up,
+# so it is answered locally instead of spending a Claude call on it
+FALLBACK_REPLY = "I'm unable to connect to the GO Transit server right now, so I can't look up schedules or fares. Please try again in a moment. (Query: {query})"
+
+# Reply when the Claude API call itself fails; nothing is wrong with the GO Transit server then
+CLAUDE_ERROR_REPLY = "Sorry, I encountered a Claude API error: {error}"
+
+# After a failed connect, skip straight to the fallback reply for this long instead of retrying every turn
+MCP_RETRY_AFTER = 30
+
+def fallback_turn(messages, user_input, placeholder=None):
+    """Answer the turn with FALLBACK_REPLY and record it in messages"""
+    text_content = FALLBACK_REPLY.format(query=user_input)
+    if placeholder is not None:
+        placeholder.markdown(text_content)
+    messages.append({"role": "user", "content": user_input})
+    # Plain text, so there is no tool_use left waiting for a tool_result
+    messages.append({"role": "assistant", "content": text_content})
+    return text_content, messages
+
+# Identical questions asked with identical history get the same answer for a couple of minutes -
+# no longer than the tool results behind it, which carry departures and real-time status
+RESPONSE_CACHE_TTL = TOOL_RESULT_CACHE_TTL
+
+@st.cache_resource
+def shared_response_cache():
+    """Process-wide cache of finished turns: key -> (reply text, messages the turn appended)"""
+    return TTLCache(maxsize=256, ttl=RESPONSE_CACHE_TTL), threading.Lock()
+
+def message_text(message):
+    """The parts of a message that affect the answer, without ids or other volatile fields"""
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    
+    parts = []
+    for block in content:
+        if isinstance(block, dict):
+            parts.append(str(block.get("content", "")))
+        elif getattr(block, "type", None) == "tool_use":
+            parts.append(block.name + orjson.dumps(block.input, option=orjson.OPT_SORT_KEYS).decode())
+        else:
+            parts.append(getattr(block, "text", ""))
+    return "\0".join(parts)
+
+QUESTION_NOISE_PATTERN = re.compile(r"[^\w\s:]+")
+
+def normalize_question(text):
+    """Question text with the differences that can't change the answer removed, for the response cache.
+    
+    Case, punctuation and spacing are dropped, known station names become their codes
+    ("Union Station" and "union" both become UN) and today/tomorrow become day names.
+    """
+    text = STATION_MENTION_PATTERN.sub(lambda match: STATION_ALIASES[match.group(1).lower()], text)
+    words = QUESTION_NOISE_PATTERN.sub(" ", text.lower()).split()
+    current_day, _, tomorrow_day, _ = day_strings(datetime.now(EASTERN_TZ).date())
+    days = {"today": current_day.lower(), "tomorrow": tomorrow_day.lower()}
+    words = [days.get(word, word) for word in words if word not in ("station", "stn", "go")]
+    return " ".join(words)
+
+def response_cache_key(messages, user_input):
+    """Hash of the conversation so far plus the new question"""
+    digest = hashlib.blake2b(digest_size=16)
+    # Answers about "today" and "tomorrow" change with the date, and "next train" with the time;
+    # a question asked in a later RESPONSE_CACHE_TTL window is never answered from an earlier one
+    now = datetime.now(EASTERN_TZ)
+    digest.update(f"{now:%Y%m%d}/{int(now.timestamp()) // RESPONSE_CACHE_TTL}".encode())
+    for message in messages:
+        digest.update(b"\1" + message["role"].encode() + b"\0" + message_text(message).encode())
+    digest.update(b"\1" + normalize_question(user_input).encode())
+    return digest.hexdigest()
+
+# Once the turns before the last few are over budget by themselves, they are folded into one summary
+SUMMARY_KEEP_TURNS = 2
+
+SUMMARY_PREFIX = "Summary of the conversation so far: "
+
+SUMMARY_PROMPT = "Summarize this GO Transit chat in a few sentences. Keep the stations, dates, times, trips and fares the user asked about and what they were told."
+
+async def summarize_history(messages):
+    """Replace old turns with a short summary, in place, so the compression is only paid for once"""
+    turn_starts = [i for i, message in enumerate(messages) if message["role"] == "user" and isinstance(message["content"], str)]
+    if len(turn_starts) <= SUMMARY_KEEP_TURNS:
+        return
+    
+    # Only what would be folded counts: big recent turns alone must not trigger a summary every turn
+    cut = turn_starts[-SUMMARY_KEEP_TURNS]
+    if cut == 1 and messages[0]["content"].startswith(SUMMARY_PREFIX):
+        return
+    if sum(estimate_tokens(message) for message in messages[:cut]) <= HISTORY_TOKEN_BUDGET:
+        return
+    
+    transcript = "\n".join(f"{message['role']}: {message_text(message)[:2000]}" for message in messages[:cut])
+    try:
+        response = await get_anthropic_client().messages.create(
+            model=MODEL,
+            max_tokens=512,
+            system=SUMMARY_PROMPT,
+            messages=[{"role": "user", "content": transcript}],
+        )
+    except Exception:
+        # Not worth failing the turn over; trim_messages still bounds what is sent
+        return
+    
+    summary, _ = split_response(response)
+    messages[:cut] = [{"role": "user", "content": SUMMARY_PREFIX + summary}]
+
+def sync_chat_response(messages, user_input, placeholder=None):
+    """Synchronous wrapper for the async chat logic for GO Transit queries"""
+    # Fold old turns into a summary first, so everything below works on the compacted history
+    get_event_loop().run_until_complete(summarize_history(messages))
+    
+    # Same question in the same context: replay the finished turn instead of calling Claude and MCP again
+    response_cache, response_cache_lock = shared_response_cache()
+    cache_key = response_cache_key(messages, user_input)
+    with response_cache_lock:
+        cached = response_cache.get(cache_key)
+    if cached is not None:
+        text_content, turn_messages = cached
+        messages.extend(turn_messages)
+        if placeholder is not None:
+            placeholder.markdown(text_content)
+        return text_content, messages
+    
+    async def _chat():
+        # This session failed to connect a moment ago: don't wait on another connect timeout.
+        # Kept per session - another user's failed connect says nothing about this session's working one.
+        if monotonic() - st.session_state.get("mcp_down_at", float("-inf")) < MCP_RETRY_AFTER:
+            st.warning("GO Transit MCP server is unavailable. Using fallback mode...")
+            return fallback_turn(messages, user_input, placeholder)
         
+        try:
+            # Connection and tool list are set up once per session, not every turn
+            client, tools = await get_mcp_session()
         except Exception as e:
+            st.session_state["mcp_down_at"] = monotonic()
             st.error(f"Failed to connect to GO Transit MCP server: {e}")
             st.warning("Using fallback mode...")
+            return fallback_turn(messages, user_input, placeholder)
+        
+        try:
+            if not tools:
+                st.warning("No GO Transit tools found. Using fallback mode.")
+                tools = FALLBACK_TOOLS_FULL
             
-            # Fallback mode - basic transit info
-            tools = [
-                {
-                    "name": "basic_transit_info",
-                    "description": "Provide basic GO Transit information",
-                    "input_schema": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "Transit query"
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            ]
-            
-            messages.append({"role": "user", "content": user_input})
-            response = await chat_with_claude(messages, tools)
-            
-            # Extract text content and add to messages
-            text_content = ""
-            for content_item in response.content:
-                if hasattr(content_item, 'type') and content_item.type == 'text':
-                    text_content += content_item.text
-            
-            messages.append({"role": "assistant", "content": text_content})
-            
-            # Check for tool uses in fallback mode
-            fallback_tool_uses = []
-            for content_item in response.content:
-                if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                    fallback_tool_uses.append(content_item)
+            # The turn is built apart from the session's history and only added to it once it is
+            # complete. If it is cut short (an error, or Streamlit stopping the script between a
+            # tool_use and its tool_result), the history never holds a half turn that the API would reject.
+            turn = [{"role": "user", "content": user_input}]
             
-            if fallback_tool_uses:
-                # Process all tool calls in sequence (fallback mode)
-                for tool_use in fallback_tool_uses:
-                    arguments = tool_use.input
-                    tool_result = f"I'm unable to connect to the GO Transit server right now. Please try asking about train schedules, fares, or routes and I'll do my best to help! (Query: {arguments['query']})"
-                    
-                    messages.append({
-                        "role": "user",
-                        "content": f"Tool result for {tool_use.name}: {tool_result}"
-                    })
-                
-                # Get final response and check for additional tool calls
-                final_response = await chat_with_claude(messages, tools)
-                
-                # Extract text content and add to messages
-                final_text_content = ""
-                for content_item in final_response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'text':
-                        final_text_content += content_item.text
-                
-                messages.append({"role": "assistant", "content": final_text_content})
+            # Keep going until Claude answers without asking for more tools; once tool results are in,
+            # the pass that (most likely) writes the answer goes to the reply model
+            model = MODEL
+            turn_failed = False
+            while True:
+                response = await chat_with_claude(messages + turn, tools, placeholder, model)
                 
-                # Handle additional tool calls in fallback mode
-                final_fallback_tool_uses = []
-                for content_item in final_response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                        final_fallback_tool_uses.append(content_item)
+                # Split out the text and tool calls, and add the assistant response to the turn
+                text_content, tool_uses = split_response(response)
+                turn.append({"role": "assistant", "content": response.content})
                 
-                while final_fallback_tool_uses:
-                    st.info("Processing additional tool calls in fallback mode...")
-                    
-                    for tool_use in final_fallback_tool_uses:
-                        arguments = tool_use.input
-                        tool_result = f"I'm unable to connect to the GO Transit server right now. Please try asking about train schedules, fares, or routes and I'll do my best to help! (Query: {arguments['query']})"
-                        
-                        messages.append({
-                            "role": "user",
-                            "content": f"Tool result for {tool_use.name}: {tool_result}"
-                        })
-                    
-                    final_response = await chat_with_claude(messages, tools)
-                    
-                    # Extract text content and add to messages
-                    final_text_content = ""
-                    for content_item in final_response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'text':
-                            final_text_content += content_item.text
-                    
-                    messages.append({"role": "assistant", "content": final_text_content})
-                    
-                    # Check for more tool uses
-                    final_fallback_tool_uses = []
-                    for content_item in final_response.content:
-                        if hasattr(content_item, 'type') and content_item.type == 'tool_use':
-                            final_fallback_tool_uses.append(content_item)
-                
-                # Extract text content from final response in fallback mode
-                text_content = ""
-                for content_item in final_response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'text':
-                        text_content += content_item.text
+                if not tool_uses:
+                    messages.extend(turn)
+                    # A turn built on a failed lookup would replay that failure to every session
+                    if not turn_failed:
+                        with response_cache_lock:
+                            response_cache[cache_key] = (text_content, turn)
+                    return text_content, messages
                 
-                return text_content, messages
-            else:
-                # Extract text content from response in fallback mode
-                text_content = ""
-                for content_item in response.content:
-                    if hasattr(content_item, 'type') and content_item.type == 'text':
-                        text_content += content_item.text
+                # The tool calls are independent, so run them on the GO Transit MCP server concurrently
+                tool_results = await run_tool_calls(client, tool_uses)
                 
-                return text_content, messages
+                # Add tool responses to the turn
+                turn.append(tool_results_message(tool_uses, tool_results))
+                turn_failed = turn_failed or any(result.startswith("Error:") for result in tool_results)
+                model = REPLY_MODEL
+        
+        except anthropic.APIError as e:
+            # Claude failed, not the GO Transit server: keep the MCP session and say what went wrong.
+            # The turn is left out of the history so the next question starts clean.
+            text_content = CLAUDE_ERROR_REPLY.format(error=e)
+            if placeholder is not None:
+                placeholder.markdown(text_content)
+            return text_content, messages
+        
+        except Exception as e:
+            # The connection may be dead; reconnect on the next turn
+            await close_mcp_session()
+            
+            st.error(f"GO Transit request failed: {e}")
+            st.warning("Using fallback mode...")
+            return fallback_turn(messages, user_input, placeholder)
     
-    return asyncio.run(_chat())
+    # Run on the session's own loop rather than asyncio.run, which would close it (and the client's pool) each turn
+    return get_event_loop().run_until_complete(_chat())
+
+# Warm-up is only a head start; past this the first turn connects (and reports problems) itself
+WARM_UP_TIMEOUT = 3
+
+async def warm_up():
+    """Open the MCP session, the tool list and the Anthropic connection so the first question doesn't pay for them"""
+    
+    async def _mcp():
+        await shared_tools(await connect_mcp_session(), quiet=True)
+    
+    await asyncio.gather(_mcp(), get_anthropic_client().models.list(limit=1), return_exceptions=True)
+
+def sync_warm_up():
+    """Warm this browser session's connections once, without any UI and for at most WARM_UP_TIMEOUT seconds"""
+    if not st.session_state.get("warmed_up"):
+        st.session_state["warmed_up"] = True
+        try:
+            get_event_loop().run_until_complete(asyncio.wait_for(warm_up(), WARM_UP_TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+
+# Turns shown inline in the chat history; older ones go behind an expander
+HISTORY_DISPLAY_TURNS = 20
+
+def history_markdown(turns):
+    """Older turns as one Markdown document, so they cost one element instead of a pair of chat bubbles each"""
+    return "\n\n---\n\n".join(f"**You:** {user}\n\n**🚆 Assistant:**\n\n{bot}" for user, bot in turns)
+
+def render_turn(user, bot):
+    """Show one question and its answer as chat bubbles"""
+    with st.chat_message("user"):
+        st.markdown(user)
+    with st.chat_message("assistant", avatar="🚆"):
+        st.markdown(bot)
 
 def main():
     st.title("🚆 GO Transit Assistant")
@@ -630,16 +1205,12 @@ def main():
         st.session_state["messages"] = []
     if "history" not in st.session_state:
         st.session_state["history"] = []
-    if "reset_counter" not in st.session_state:
-        st.session_state["reset_counter"] = 0
-    if "input_submitted" not in st.session_state:
-        st.session_state["input_submitted"] = False
     
     # Connection status and quick actions
     with st.sidebar:
         st.header("🚆 GO Transit Info")
         st.info(f"Server: {server_url}")
-        st.success("GO Transit MCP Client Ready! (Claude 3.5 Haiku)")
+        st.success(f"GO Transit MCP Client Ready! ({MODEL if REPLY_MODEL == MODEL else f'{MODEL} / {REPLY_MODEL}'})")
         
         st.markdown("---")
         st.header("Quick Examples")
@@ -680,58 +1251,61 @@ def main():
         ⏰ **Current Time**: Always up-to-date time context
         """)
     
+    chat_panel()
+    
+    # After everything is on screen, so the first page load doesn't wait on the connects
+    sync_warm_up()
+
+@st.fragment
+def chat_panel():
+    """Chat history and input; sending or resetting reruns only this fragment, not the page and sidebar"""
     # Display chat history
     st.header("Chat History")
     if not st.session_state["history"]:
         st.info("No messages yet. Ask me about GO Transit schedules, fares, or routes!")
     else:
-        for i, (user, bot) in enumerate(st.session_state["history"]):
-            with st.container():
-                col1, col2 = st.columns([1, 4])
-                with col1:
-                    st.markdown("**You:**")
-                with col2:
-                    st.markdown(user)
-                
-                col1, col2 = st.columns([1, 4])
-                with col1:
-                    st.markdown("**🚆 Assistant:**")
-                with col2:
-                    st.markdown(bot)
-                
-                if i < len(st.session_state["history"]) - 1:
-                    st.divider()
+        history = st.session_state["history"]
+        older, recent = history[:-HISTORY_DISPLAY_TURNS], history[-HISTORY_DISPLAY_TURNS:]
+        
+        # Collapse everything but the latest turns so long chats don't re-render hundreds of elements
+        if older:
+            with st.expander(f"Earlier messages ({len(older)})"):
+                st.markdown(history_markdown(older))
+        
+        for user, bot in recent:
+            render_turn(user, bot)
     
     # Chat interface - moved below chat history
     st.markdown("---")
     st.header("Ask about your GO Transit trip")
     
-    # Input field and buttons on same line
-    user_input = st.text_input("", 
-                              key=f"user_input_{st.session_state['reset_counter']}", 
-                              placeholder="e.g., 'Find trains from Milton to Union Station tomorrow morning'")
-    
-    # Buttons on same line
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        send_button = st.button("Send")
-    with col2:
-        reset = st.button("Reset Chat")
+    # A form only submits on Send/Reset (not on every keystroke) and clears the input itself
+    with st.form("chat", clear_on_submit=True):
+        user_input = st.text_input("", 
+                                  placeholder="e.g., 'Find trains from Milton to Union Station tomorrow morning'")
+        
+        # Buttons on same line
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            send_button = st.form_submit_button("Send")
+        with col2:
+            reset = st.form_submit_button("Reset Chat")
     
     if reset:
         st.session_state["messages"] = []
         st.session_state["history"] = []
-        st.session_state["reset_counter"] += 1  # Change the key to force input reset
-        st.rerun()
+        st.rerun(scope="fragment")
     
     if send_button and user_input:
+        # Claude's reply streams in here while the turn is running
+        response_placeholder = st.empty()
         with st.spinner("Connecting to GO Transit server and searching..."):
             try:
-                response, updated_messages = sync_chat_response(st.session_state["messages"], user_input)
+                response, updated_messages = sync_chat_response(st.session_state["messages"], user_input, response_placeholder)
                 st.session_state["messages"] = updated_messages  # Persist conversation context
                 st.session_state["history"].append((user_input, response))
-                st.session_state["reset_counter"] += 1  # Force input field to reset
-                st.rerun()
+                # Redraw the history above the form with this turn in it
+                st.rerun(scope="fragment")
             except Exception as e:
                 st.error("An error occurred:")
                 st.error(str(e))